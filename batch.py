@@ -0,0 +1,203 @@
+"""
+Headless batch processing for Video Effects Pro
+
+Runs the same effect implementations as the Streamlit app over many videos
+with a bounded pool of worker processes that are reused across files:
+
+    python batch.py clips/ -o out/ -e flip:flip_type=Right -e sketch:tier=fast
+    python batch.py manifest.txt -o out/ -e earthquake:seed=1 --workers 4
+    python batch.py clips/ -o out/ -e reverse --encoder ffmpeg:preset=fast
+
+Inputs may be directories (scanned for video files) or manifests (a .json
+list of paths or a text file with one path per line). Each output gets a
+.json sidecar recording its input, effects and encoder; re-runs skip outputs
+whose sidecar matches and a JSON report with per-file timing is written.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import cv2
+
+import videdit
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+def parse_effect(spec):
+    """Parse "name:key=value,key=value" into a (name, params) pair"""
+    name, params = _parse_spec(spec)
+    if name not in videdit.FRAME_EFFECTS and name not in videdit.TIMING_EFFECTS:
+        raise ValueError(f"Unknown effect: {name}")
+    return name, params
+
+def parse_encoder(spec):
+    """Parse "name:key=value,..." into an encoder spec (see videdit.make_writer)"""
+    name, params = _parse_spec(spec)
+    if name not in videdit.ENCODERS:
+        raise ValueError(f"Unknown encoder: {name}")
+    return name, params
+
+def _parse_spec(spec):
+    name, _, raw_params = spec.partition(':')
+    params = {}
+    for item in filter(None, raw_params.split(',')):
+        key, _, value = item.partition('=')
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return name, params
+
+def collect_inputs(paths):
+    """Expand directories and manifests into a sorted list of video paths"""
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                inputs.extend(os.path.join(root, name) for name in names
+                              if name.lower().endswith(VIDEO_EXTENSIONS))
+        elif path.lower().endswith(VIDEO_EXTENSIONS):
+            inputs.append(path)
+        elif path.endswith('.json'):
+            with open(path) as f:
+                inputs.extend(json.load(f))
+        else:
+            with open(path) as f:
+                inputs.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return sorted(dict.fromkeys(inputs))
+
+def output_path_for(input_path, output_dir):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(input_path))[0] + '.mp4')
+
+def spec_path_for(output_path):
+    return output_path + '.json'
+
+def render_spec(input_path, effects, encoder=None):
+    """What an output is rendered from, as stored in its sidecar"""
+    spec = {
+        "input": os.path.abspath(input_path),
+        "effects": [[name, params] for name, params in effects],
+        "encoder": list(encoder or videdit.DEFAULT_ENCODER),
+    }
+    # نفس الشكل الذي يُقرأ من ملف JSON للمقارنة
+    return json.loads(json.dumps(spec))
+
+def is_up_to_date(output_path, spec):
+    """Whether output_path exists and its sidecar records the same spec"""
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return False
+    try:
+        with open(spec_path_for(output_path)) as f:
+            return json.load(f) == spec
+    except (OSError, ValueError):
+        return False
+
+def _init_worker(threads):
+    cv2.setNumThreads(threads)
+
+def process_one(input_path, output_path, effects, threads, encoder=None, spec=None):
+    """Render one video, recording spec in its sidecar; returns a report entry"""
+    entry = {"input": input_path, "output": output_path}
+    frames = 0
+    
+    # الكتابة في ملف جزئي حتى لا يُعتبر الناتج المقطوع مكتملاً
+    partial_path = output_path + '.partial.mp4'
+    spec_path = spec_path_for(output_path)
+    start = time.perf_counter()
+    try:
+        if os.path.exists(spec_path):
+            os.remove(spec_path)
+        source = videdit.video_source(input_path)
+        if not source.is_opened:
+            raise IOError(f"Cannot open video: {input_path}")
+        frames = source.frame_count
+        videdit.apply_effects(input_path, partial_path, effects, workers=threads, encoder=encoder)
+        os.replace(partial_path, output_path)
+        if spec is not None:
+            with open(spec_path, 'w') as f:
+                json.dump(spec, f, indent=2)
+    except Exception as e:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        entry.update(status="failed", error=f"{type(e).__name__}: {e}")
+    else:
+        entry["status"] = "done"
+    seconds = time.perf_counter() - start
+    entry.update(seconds=round(seconds, 3), frames=frames,
+                 fps=round(frames / seconds, 2) if entry["status"] == "done" and seconds else None)
+    return entry
+
+def run_batch(inputs, output_dir, effects, workers=None, report_path=None, skip_existing=True, encoder=None):
+    """
+    Process many videos with a bounded pool of reusable worker processes
+    With skip_existing, outputs already rendered from the same input, effects
+    and encoder (see render_spec) are skipped. Returns the report dict, also
+    written to report_path as JSON when given.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(inputs) or 1))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    specs = {input_path: render_spec(input_path, effects, encoder) for input_path in inputs}
+    # كل عملية تستخدم نصيبها من الأنوية فقط
+    encoder = videdit.with_encoder_threads(encoder, threads)
+    
+    report = {
+        "started": datetime.now().isoformat(timespec='seconds'),
+        "effects": [[name, params] for name, params in effects],
+        "encoder": list(encoder or videdit.DEFAULT_ENCODER),
+        "workers": workers,
+        "jobs": [],
+    }
+    start = time.perf_counter()
+    
+    pending = []
+    for input_path in inputs:
+        output_path = output_path_for(input_path, output_dir)
+        if skip_existing and is_up_to_date(output_path, specs[input_path]):
+            report["jobs"].append({"input": input_path, "output": output_path, "status": "skipped"})
+        else:
+            pending.append((input_path, output_path))
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = [pool.submit(process_one, input_path, output_path, effects, threads, encoder, specs[input_path])
+                   for input_path, output_path in pending]
+        for future in as_completed(futures):
+            entry = future.result()
+            report["jobs"].append(entry)
+            logging.info(f"{entry['status']}: {entry['input']} ({entry['seconds']}s, {entry['fps']} fps)")
+    
+    report["jobs"].sort(key=lambda entry: entry["input"])
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    report["totals"] = {status: sum(1 for entry in report["jobs"] if entry["status"] == status)
+                        for status in ("done", "skipped", "failed")}
+    
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply Video Effects Pro effects to many videos")
+    parser.add_argument('inputs', nargs='+', help="video files, directories or manifest files")
+    parser.add_argument('-o', '--output-dir', required=True)
+    parser.add_argument('-e', '--effect', action='append', default=[], type=parse_effect,
+                        help="effect as name[:key=value,...], applied in the order given, e.g. black_and_white:theme=inverted")
+    parser.add_argument('--encoder', default=None, type=parse_encoder,
+                        help="output encoder as name[:key=value,...], e.g. ffmpeg:preset=fast (default: opencv)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="concurrent videos (default: one per CPU)")
+    parser.add_argument('-r', '--report', default=None, help="JSON report path (default: OUTPUT_DIR/report.json)")
+    parser.add_argument('--force', action='store_true', help="re-render outputs even if their sidecar matches")
+    args = parser.parse_args(argv)
+    
+    inputs = collect_inputs(args.inputs)
+    report_path = args.report or os.path.join(args.output_dir, 'report.json')
+    report = run_batch(inputs, args.output_dir, args.effect, args.workers, report_path, not args.force, args.encoder)
+    print(json.dumps(report["totals"]))
+    return 1 if report["totals"]["failed"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
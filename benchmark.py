@@ -0,0 +1,218 @@
+"""
+Per-effect benchmarks for Video Effects Pro
+
+Generates deterministic synthetic test videos, runs every effect on them in
+a fresh process and records frames/sec, wall time, encode time, peak RSS and
+output size:
+
+    python benchmark.py                                # quick preset
+    python benchmark.py --encoder opencv --encoder x264_fast --encoder x264_small
+    python benchmark.py --preset full --save-baseline bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json --threshold 0.1
+
+With --baseline the run fails (exit code 1) when any case is slower, or
+uses more memory, than the baseline by more than the threshold.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import videdit
+
+RESOLUTIONS = {
+    "480p": (854, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+PRESETS = {
+    "quick": [("480p", 5), ("720p", 5)],
+    "standard": [("480p", 5), ("720p", 5), ("1080p", 5), ("1080p", 30)],
+    "full": [(resolution, seconds) for resolution in RESOLUTIONS for seconds in (5, 30, 300)],
+}
+
+BENCH_FPS = 30
+
+EFFECT_CASES = {
+    "earthquake": [("earthquake", {"seed": 0})],
+    "flip": [("flip", {"flip_type": "Right"})],
+    "speed_up": [("speed_up", {"speed_factor": 2.0})],
+    "slow_motion": [("slow_motion", {"speed_factor": 2.0})],
+    "reverse": [("reverse", {})],
+    "black_and_white": [("black_and_white", {"theme": "dark_theme"})],
+    "sketch": [("sketch", {})],
+    "sketch_fast": [("sketch", {"tier": "fast"})],
+    "chain": [("flip", {"flip_type": "Horizontal"}), ("black_and_white", {"theme": "normal"}), ("sketch", {})],
+}
+
+# Output encoders to compare; cases with a non-default encoder get an
+# "@encoder" suffix on their key
+ENCODER_CASES = {
+    "opencv": None,
+    "x264_fast": ("ffmpeg", {"preset": "fast"}),
+    "x264_balanced": ("ffmpeg", {"preset": "balanced"}),
+    "x264_small": ("ffmpeg", {"preset": "small"}),
+}
+
+def synthetic_video(path, width, height, seconds, fps=BENCH_FPS, seed=0):
+    """
+    Write a deterministic test clip: a textured background panning under
+    moving shapes, so encoders and effects see realistic motion and detail
+    """
+    rng = np.random.default_rng(seed)
+    texture = rng.integers(0, 256, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    texture = cv2.resize(texture, (width * 2, height), interpolation=cv2.INTER_CUBIC)
+    shapes = rng.integers(0, 256, (12, 6))
+    
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    try:
+        for index in range(int(seconds * fps)):
+            offset = (index * 4) % width
+            frame = texture[:, offset:offset + width].copy()
+            for x, y, radius, b, g, r in shapes:
+                center = (int(x * width / 256 + index * 3) % width, int(y * height / 256))
+                cv2.circle(frame, center, int(radius / 256 * height / 6) + 4, (int(b), int(g), int(r)), -1)
+            out.write(frame)
+    finally:
+        out.release()
+
+def ensure_video(video_dir, resolution, seconds):
+    width, height = RESOLUTIONS[resolution]
+    path = os.path.join(video_dir, f"bench_{resolution}_{seconds}s.mp4")
+    if not os.path.exists(path):
+        synthetic_video(path + '.partial.mp4', width, height, seconds)
+        os.replace(path + '.partial.mp4', path)
+    return path
+
+def _run_case(video_path, output_path, effects, results, encoder=None):
+    """Child process: render once and report wall time, encode time and peak RSS"""
+    metrics = videdit.JobMetrics(job="benchmark")
+    start = time.perf_counter()
+    videdit.apply_effects(video_path, output_path, effects, metrics=metrics, encoder=encoder)
+    wall = time.perf_counter() - start
+    # ru_maxrss بالكيلوبايت على لينكس وبالبايت على ماك
+    scale = 1 if sys.platform == 'darwin' else 1024
+    results.put({"wall": wall, "encode": metrics.stage_seconds["encode"],
+                 "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale})
+
+def _wait_for_result(process, results, poll_seconds=1.0):
+    """The child's result, or RuntimeError as soon as it exits without one"""
+    while True:
+        try:
+            return results.get(timeout=poll_seconds)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # النتيجة قد تصل بعد خروج العملية مباشرة
+        try:
+            return results.get(timeout=poll_seconds)
+        except queue.Empty:
+            process.join()
+            raise RuntimeError(f"benchmark process failed with exit code {process.exitcode}") from None
+
+def run_case(video_path, effects, repeat=1, encoder=None):
+    """Run one effect case in fresh processes; keeps the fastest of repeat runs"""
+    context = multiprocessing.get_context("spawn")
+    best = None
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_path = os.path.join(work_dir, "out.mp4")
+        for _ in range(repeat):
+            results = context.Queue()
+            process = context.Process(target=_run_case, args=(video_path, output_path, effects, results, encoder))
+            process.start()
+            result = _wait_for_result(process, results)
+            process.join()
+            if best is None or result["wall"] < best["wall"]:
+                best = result
+        best["output_bytes"] = os.path.getsize(output_path)
+    return best
+
+def run_benchmarks(preset="quick", effects=None, video_dir=None, repeat=1, encoders=("opencv",)):
+    """Benchmark every effect case on every clip of a preset, once per encoder"""
+    video_dir = video_dir or os.path.join(tempfile.gettempdir(), "videdit-bench")
+    os.makedirs(video_dir, exist_ok=True)
+    
+    cases = {}
+    for resolution, seconds in PRESETS[preset]:
+        video_path = ensure_video(video_dir, resolution, seconds)
+        frames = seconds * BENCH_FPS
+        for name in effects or EFFECT_CASES:
+            for encoder in encoders:
+                result = run_case(video_path, EFFECT_CASES[name], repeat, ENCODER_CASES[encoder])
+                key = f"{name}/{resolution}/{seconds}s" + (f"@{encoder}" if ENCODER_CASES[encoder] else "")
+                cases[key] = {
+                    "fps": round(frames / result["wall"], 2),
+                    "wall_seconds": round(result["wall"], 3),
+                    "encode_seconds": round(result["encode"], 3),
+                    "peak_rss_mb": round(result["peak_rss"] / (1024 * 1024), 1),
+                    "output_bytes": result["output_bytes"],
+                }
+                print(f"{key:46s} {cases[key]['fps']:8.1f} fps {cases[key]['wall_seconds']:8.2f} s "
+                      f"{cases[key]['encode_seconds']:8.2f} s enc {cases[key]['peak_rss_mb']:8.1f} MB "
+                      f"{cases[key]['output_bytes'] / 1e6:8.2f} MB out", flush=True)
+    
+    return {
+        "preset": preset,
+        "machine": {"platform": platform.platform(), "cpus": os.cpu_count(), "opencv": cv2.__version__},
+        "cases": cases,
+    }
+
+def compare(results, baseline, threshold):
+    """List regressions: cases slower or larger in peak RSS than baseline by more than threshold"""
+    regressions = []
+    for key, current in results["cases"].items():
+        previous = baseline.get("cases", {}).get(key)
+        if previous is None:
+            continue
+        if current["fps"] < previous["fps"] * (1 - threshold):
+            regressions.append(f"{key}: {current['fps']} fps vs baseline {previous['fps']} fps")
+        if current["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + threshold):
+            regressions.append(f"{key}: {current['peak_rss_mb']} MB peak RSS vs baseline {previous['peak_rss_mb']} MB")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Video Effects Pro effects")
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick')
+    parser.add_argument('--effect', action='append', choices=sorted(EFFECT_CASES), help="limit to these effect cases")
+    parser.add_argument('--encoder', action='append', choices=list(ENCODER_CASES),
+                        help="output encoders to compare (default: opencv)")
+    parser.add_argument('--video-dir', default=None, help="where synthetic test videos are generated and reused")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per case; the fastest is kept")
+    parser.add_argument('--output', default=None, help="write results JSON here")
+    parser.add_argument('--baseline', default=None, help="baseline JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed relative regression (default 0.10)")
+    parser.add_argument('--save-baseline', default=None, help="write results as a new baseline")
+    args = parser.parse_args(argv)
+    
+    missing = [name for name in args.encoder or [] if ENCODER_CASES[name] and ENCODER_CASES[name][0] == "ffmpeg"]
+    if missing and shutil.which("ffmpeg") is None:
+        parser.error(f"encoders {', '.join(missing)} need ffmpeg on PATH")
+    
+    results = run_benchmarks(args.preset, args.effect, args.video_dir, args.repeat, args.encoder or ["opencv"])
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+import videdit
+from videdit import resample_plan, resampled_frame
+
+FPS = 30.0
+
+
+def check_windows(plan, total_frames):
+    lo, hi = plan["lo"], plan["hi"]
+    assert len(lo) == len(hi)
+    assert np.all(lo >= 0) and np.all(hi <= total_frames)
+    assert np.all(hi > lo)
+    assert np.all(np.diff(lo) >= 0)
+
+
+@pytest.mark.parametrize("mode", videdit.RESAMPLE_MODES)
+@pytest.mark.parametrize("rate", [0.25, 0.4, 0.5, 0.75, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0])
+@pytest.mark.parametrize("total_frames", [1, 2, 3, 7, 90, 101])
+def test_windows_and_duration(total_frames, rate, mode):
+    plan = resample_plan(total_frames, FPS, rate, mode)
+    check_windows(plan, total_frames)
+    # المدة الناتجة تساوي المدة الأصلية مقسومة على السرعة، لأقرب إطار
+    duration = len(plan["lo"]) / plan["fps"]
+    assert abs(duration - total_frames / FPS / rate) <= 1 / plan["fps"] + 1e-9
+
+
+@pytest.mark.parametrize("mode", videdit.RESAMPLE_MODES)
+@pytest.mark.parametrize("rate", [0.5, 1.5, 4.0])
+def test_empty_clip(rate, mode):
+    plan = resample_plan(0, FPS, rate, mode)
+    assert len(plan["lo"]) == 0 and len(plan["hi"]) == 0
+
+
+@pytest.mark.parametrize("mode", videdit.RESAMPLE_MODES)
+@pytest.mark.parametrize("rate", [0.4, 2.5, 10.0])
+def test_single_frame_clip_keeps_its_frame(rate, mode):
+    plan = resample_plan(1, FPS, rate, mode)
+    assert len(plan["lo"]) >= 1
+    assert set(plan["lo"]) == {0} and set(plan["hi"]) == {1}
+
+
+def test_nearest_fractional_speed_up():
+    plan = resample_plan(10, FPS, 1.5, "nearest")
+    assert plan["fps"] == FPS
+    assert list(plan["lo"]) == [0, 1, 3, 4, 6, 7, 9]
+    assert list(plan["hi"] - plan["lo"]) == [1] * 7
+    assert plan["frac"] is None
+
+
+def test_nearest_slow_motion_keeps_every_frame_once():
+    plan = resample_plan(7, FPS, 0.4, "nearest")
+    assert list(plan["lo"]) == list(range(7))
+    assert plan["fps"] == pytest.approx(FPS * 0.4)
+
+
+@pytest.mark.parametrize("rate", [1.5, 2.0, 2.5, 3.7])
+@pytest.mark.parametrize("total_frames", [2, 3, 10, 101])
+def test_blend_speed_up_windows_tile_the_input(total_frames, rate):
+    plan = resample_plan(total_frames, FPS, rate, "blend")
+    lo, hi = plan["lo"], plan["hi"]
+    assert plan["fps"] == FPS and plan["frac"] is None
+    assert lo[0] == 0 and hi[-1] == total_frames
+    assert list(hi[:-1]) == list(lo[1:])
+
+
+@pytest.mark.parametrize("rate", [0.25, 0.4, 0.75])
+@pytest.mark.parametrize("total_frames", [2, 3, 10])
+def test_blend_slow_motion_cross_fades_neighbours(total_frames, rate):
+    plan = resample_plan(total_frames, FPS, rate, "blend")
+    lo, hi, frac = plan["lo"], plan["hi"], plan["frac"]
+    assert plan["fps"] == FPS
+    assert np.all((frac >= 0) & (frac < 1))
+    assert np.array_equal(hi - lo, np.where(frac > 1e-9, 2, 1))
+    assert np.allclose(lo + frac, np.minimum(np.arange(len(lo)) * rate, total_frames - 1))
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        resample_plan(10, FPS, 2.0, "cubic")
+
+
+def test_resampled_frame_rounds_the_average():
+    window = [np.full((2, 2, 3), value, np.uint8) for value in (0, 1, 1, 255)]
+    assert np.all(resampled_frame(window) == 64)
+
+
+def test_resampled_frame_long_window_does_not_overflow():
+    # أكثر من 257 إطاراً بقيمة 255 يتجاوز مدى uint16
+    window = [np.full((2, 2, 3), 255, np.uint8)] * 300
+    result = resampled_frame(window)
+    assert result.dtype == np.uint8
+    assert np.all(result == 255)
+
+
+def test_resampled_frame_cross_fade():
+    window = [np.zeros((2, 2, 3), np.uint8), np.full((2, 2, 3), 200, np.uint8)]
+    assert np.all(resampled_frame(window, 0.25) == 50)
+    single = [np.full((2, 2, 3), 7, np.uint8)]
+    assert resampled_frame(single) is single[0]